@@ -2,31 +2,43 @@
 FastAPI backend for Dlanos Family Restaurant chat widget.
 
 Endpoints:
-- GET /health  -> health check
-- POST /chat   -> chat with canned replies and LLM fallback
+- GET /health        -> health check
+- POST /chat         -> chat with canned replies and LLM fallback
+- POST /chat/stream  -> same as /chat, streamed as server-sent events
+- GET /metrics       -> Prometheus metrics (reply counts by source)
 
 Features:
 - Loads restaurant profile from restaurant.yml
 - Returns canned replies for hours/menu/address/phone
 - Calls OpenAI-compatible provider via provider_adapter for other queries
-- In-memory LRU cache of recent replies to reduce costs and latency
+- In-memory LFU cache (1h TTL) of recent replies to reduce costs and latency
 - CORS for localhost dev ports and production domain
 """
 from __future__ import annotations
 
 import asyncio
-from collections import OrderedDict
-from typing import Dict, List, Optional
-
-from fastapi import FastAPI, HTTPException
+import hashlib
+import os
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import orjson
+from cachetools import Cache, LFUCache
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from typing import Literal
 from dotenv import load_dotenv
 
-from guardrails import load_restaurant, canned_reply, build_system_prompt, postprocess
-# Load .env BEFORE importing the provider so its module reads populated env vars
+from guardrails import load_restaurant, build_canned_replies, canned_reply, build_system_prompt, postprocess
+# Load .env BEFORE importing the provider so its module reads populated env vars.
+# prometheus_client likewise picks its (multiprocess or not) value class from
+# PROMETHEUS_MULTIPROC_DIR at import time.
 load_dotenv()
+from prometheus_client import CollectorRegistry, Counter, make_asgi_app, multiprocess
 from provider_adapter import ChatProvider
 
 
@@ -45,30 +57,62 @@ class ChatResponse(BaseModel):
     source: str  # "canned" | "cache" | "llm"
 
 
-class LRUCache:
-    """Simple in-memory LRU cache for question->reply."""
-
-    def __init__(self, capacity: int = 100):
-        self.capacity = capacity
-        self._data: "OrderedDict[str, str]" = OrderedDict()
-
-    def get(self, key: str) -> Optional[str]:
-        if key in self._data:
-            self._data.move_to_end(key)
-            return self._data[key]
-        return None
-
-    def set(self, key: str, value: str) -> None:
-        self._data[key] = value
-        self._data.move_to_end(key)
-        if len(self._data) > self.capacity:
-            self._data.popitem(last=False)
+class _ExpiringLFUCache(LFUCache):
+    """LFUCache over (expires_at, value) entries that evicts expired entries first.
+
+    Plain LFU would keep a once-popular answer forever after it expires, since
+    its use count never drops; here any expired entries are purged before a
+    live entry is evicted for space.
+    """
+
+    def popitem(self):
+        now = time.monotonic()
+        # Cache.__getitem__ reads without bumping the LFU use count
+        expired = [k for k in list(self) if Cache.__getitem__(self, k)[0] <= now]
+        if not expired:
+            return super().popitem()
+        for key in expired[1:]:
+            del self[key]
+        key = expired[0]
+        return (key, self.pop(key))
+
+
+class ReplyCache:
+    """In-memory LFU cache for question->reply with TTL expiry.
+
+    Evicts the least frequently used entry, so popular answers survive bursts
+    of one-off questions. Entries carry their own expiry timestamp: an expired
+    entry is never returned, and all expired entries are evicted before any
+    live one when the cache is full. Access is serialized with an asyncio lock
+    so concurrent requests never interleave inside the underlying cache's
+    bookkeeping.
+    """
+
+    def __init__(self, capacity: int = 100, ttl: float = 3600):
+        self.ttl = ttl
+        self._data: LFUCache = _ExpiringLFUCache(maxsize=capacity)
+        self._lock = asyncio.Lock()
+
+    async def get(self, key: bytes) -> Optional[str]:
+        async with self._lock:
+            entry: Optional[Tuple[float, str]] = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    async def set(self, key: bytes, value: str) -> None:
+        async with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
 
 
 # load_dotenv here is redundant now but harmless; keeping as a fallback
 load_dotenv()  # load .env if present
 
-app = FastAPI(title="Dlanos Restaurant Chat API", version="0.1.0")
+app = FastAPI(title="Dlanos Restaurant Chat API", version="0.1.0", default_response_class=ORJSONResponse)
 
 origins = [
     "http://localhost:8080",
@@ -79,26 +123,70 @@ origins = [
     "null",  # allow file:// origins for quick local testing
 ]
 
+
+class FixedOriginCORSMiddleware(CORSMiddleware):
+    """CORSMiddleware with O(1) origin checks against a fixed allow-list.
+
+    Wildcard ("*") and allow_origin_regex configurations use Starlette's own
+    check. Preflight (OPTIONS) requests are still answered by the middleware
+    itself, before any route runs.
+    """
+
+    def __init__(self, app, allow_origins=(), **kwargs) -> None:
+        super().__init__(app, allow_origins=allow_origins, **kwargs)
+        self._origin_set = frozenset(allow_origins)
+
+    def is_allowed_origin(self, origin: str) -> bool:
+        if self.allow_all_origins or self.allow_origin_regex is not None:
+            return super().is_allowed_origin(origin)
+        return origin in self._origin_set
+
+
 app.add_middleware(
-    CORSMiddleware,
+    FixedOriginCORSMiddleware,
     allow_origins=origins,
     allow_credentials=False,
     allow_methods=["POST", "GET", "OPTIONS"],
     allow_headers=["*"],
+    max_age=7200,  # let browsers reuse preflight results (Chromium caps at 2h)
 )
 
 
+# Reply counts by source ("canned" | "cache" | "llm" | "error") for tuning the
+# cache size and keyword lists. Under several workers, set
+# PROMETHEUS_MULTIPROC_DIR so /metrics aggregates across processes.
+CHAT_REPLIES = Counter("chat_replies", "Chat replies served, by source", ["source"])
+if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+    _metrics_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(_metrics_registry)
+    app.mount("/metrics", make_asgi_app(registry=_metrics_registry))
+else:
+    app.mount("/metrics", make_asgi_app())
+
+
 # Global singletons
-CACHE = LRUCache(capacity=128)
+CACHE = ReplyCache(capacity=128, ttl=3600)
 PROVIDER = ChatProvider()
 RESTAURANT: Dict = {}
+SYSTEM_PROMPT: str = ""
+CANNED_REPLIES: Dict[str, str] = {}
 
 
 @app.on_event("startup")
 async def startup_event():
-    global RESTAURANT
+    global RESTAURANT, SYSTEM_PROMPT, CANNED_REPLIES
     # Warm load the restaurant profile
     RESTAURANT = load_restaurant()
+    # The profile never changes at runtime, so the prompt is built once
+    SYSTEM_PROMPT = build_system_prompt(RESTAURANT)
+    CANNED_REPLIES = build_canned_replies(RESTAURANT)
+    # One pooled provider client per worker process
+    await PROVIDER.open()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await PROVIDER.aclose()
 
 
 @app.get("/health")
@@ -111,56 +199,208 @@ async def root() -> Dict[str, object]:
     return {
         "name": "Dlanos Restaurant Chat API",
         "version": "0.1.0",
-        "endpoints": ["GET /health", "POST /chat"],
+        "endpoints": ["GET /health", "POST /chat", "POST /chat/stream", "GET /metrics"],
     }
 
 
-def _normalize_key(text: str) -> str:
-    return (text or "").strip().lower()
+# Filler words dropped from cache keys; negations are deliberately kept
+_STOPWORDS = frozenset({
+    "a", "an", "the", "is", "are", "am", "be", "do", "does", "did",
+    "it", "its",
+    "to", "of", "for", "in", "on", "at", "and", "or",
+    "can", "could", "would", "please", "what", "whats", "hi", "hello", "hey",
+})
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def _canonical_key(norm: str, conversation: Optional[List[ChatMessage]] = None) -> Optional[bytes]:
+    """Cache key shared by near-duplicate prompts, or None if the message should not be cached.
+
+    Takes the already-lowercased message, strips punctuation and drops filler
+    words, then hashes to a fixed-size digest. A message made only of filler
+    words or punctuation has nothing to key on and is never cached. Any
+    conversation history sent to the model is folded into the key verbatim,
+    so replies that depended on history are only reused for the same history.
+    """
+    tokens = _PUNCT_RE.sub("", norm).split()
+    canonical = " ".join(tok for tok in tokens if tok not in _STOPWORDS)
+    if not canonical:
+        return None
+    h = hashlib.blake2b(canonical.encode("utf-8"), digest_size=16)
+    for m in (conversation or [])[-6:]:
+        h.update(b"\x00" + m.role.encode("utf-8") + b"\x00" + m.content.encode("utf-8"))
+    return h.digest()
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(req: ChatRequest) -> ChatResponse:
-    user_text = (req.message or "").strip()
+def _build_messages(req: ChatRequest, user_text: str) -> List[Dict[str, str]]:
+    messages: List[Dict[str, str]] = [{"role": "system", "content": SYSTEM_PROMPT}]
+
+    # Include short history if provided (capped)
+    if req.conversation:
+        for m in req.conversation[-6:]:
+            messages.append({"role": m.role, "content": m.content})
+
+    messages.append({"role": "user", "content": user_text})
+    return messages
+
+
+def _sse(data: object, event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(data).decode()}\n\n"
+
+
+def _is_json_content_type(value: Optional[str]) -> bool:
+    if not value:
+        return False
+    maintype, _, subtype = value.partition(";")[0].strip().lower().partition("/")
+    return maintype == "application" and (subtype == "json" or subtype.endswith("+json"))
+
+
+async def _json_body(request: Request) -> Any:
+    """Decode the raw request body with orjson, reporting bad JSON like FastAPI does.
+
+    Only JSON content types are parsed, so a text/plain "simple" CORS request
+    can't skip the preflight; anything else comes back as raw bytes and fails
+    ChatRequest validation with a 422.
+    """
+    body = await request.body()
+    if not _is_json_content_type(request.headers.get("content-type")):
+        return body
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        raise RequestValidationError(
+            [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}]
+        )
+
+
+def _parse_chat_request(body: Any) -> ChatRequest:
+    try:
+        return ChatRequest.model_validate(body)
+    except ValidationError as e:
+        raise RequestValidationError([{**err, "loc": ("body", *err["loc"])} for err in e.errors()])
+
+
+# /chat reads its body by hand, so point the docs at the ChatRequest schema
+_CHAT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": {"$ref": "#/components/schemas/ChatRequest"}}},
+    }
+}
+
+
+@app.post("/chat", response_model=ChatResponse, openapi_extra=_CHAT_REQUEST_BODY)
+async def chat(request: Request) -> ChatResponse:
+    # Most questions are canned, so answer those straight from the raw body and
+    # only build the validated ChatRequest when falling through to cache/LLM.
+    body = await _json_body(request)
+    message = body.get("message") if isinstance(body, dict) else None
+    if not isinstance(message, str):
+        # Malformed body: this raises the usual 422
+        req = _parse_chat_request(body)
+        message = req.message
+    user_text = message.strip()
     if not user_text:
         raise HTTPException(status_code=400, detail="message is required")
+    # Lowercased once; shared by intent detection and the cache key
+    norm = user_text.lower()
 
     # 1) Canned replies (hours/menu/address/phone)
-    canned = canned_reply(user_text, RESTAURANT)
+    canned = canned_reply(user_text, CANNED_REPLIES, norm)
     if canned:
+        CHAT_REPLIES.labels("canned").inc()
         return ChatResponse(reply=canned, source="canned")
 
+    req = _parse_chat_request(body)
+
     # 2) Cache lookup
-    key = _normalize_key(user_text)
-    cached = CACHE.get(key)
+    key = _canonical_key(norm, req.conversation)
+    cached = await CACHE.get(key) if key is not None else None
     if cached:
+        CHAT_REPLIES.labels("cache").inc()
         return ChatResponse(reply=cached, source="cache")
 
     # 3) LLM fallback via provider adapter
-    system = build_system_prompt(RESTAURANT)
-    messages: List[Dict[str, str]] = [{"role": "system", "content": system}]
-
-    # Include short history if provided (capped)
-    if req.conversation:
-        for m in req.conversation[-6:]:
-            messages.append({"role": m.role, "content": m.content})
-
-    messages.append({"role": "user", "content": user_text})
+    messages = _build_messages(req, user_text)
 
     try:
         reply = await PROVIDER.chat(messages, temperature=0.2, max_tokens=512)
         reply = postprocess(reply)
     except Exception as e:  # noqa: BLE001 - return clean error message
         # Graceful fallback if provider fails
+        CHAT_REPLIES.labels("error").inc()
         raise HTTPException(status_code=502, detail=f"Provider error: {e}")
 
-    if reply:
-        CACHE.set(key, reply)
+    if reply and key is not None:
+        await CACHE.set(key, reply)
 
+    CHAT_REPLIES.labels("llm").inc()
     return ChatResponse(reply=reply, source="llm")
 
 
+@app.post("/chat/stream")
+async def chat_stream(req: ChatRequest) -> StreamingResponse:
+    """Like /chat, but streams the reply as server-sent events.
+
+    Each event carries {"delta": <text>, "source": <source>}; canned and cached
+    replies arrive as a single delta. The stream ends with a "done" event, or
+    an "error" event if the provider fails mid-way.
+    """
+    user_text = (req.message or "").strip()
+    if not user_text:
+        raise HTTPException(status_code=400, detail="message is required")
+    norm = user_text.lower()
+
+    async def events() -> AsyncIterator[str]:
+        canned = canned_reply(user_text, CANNED_REPLIES, norm)
+        if canned:
+            CHAT_REPLIES.labels("canned").inc()
+            yield _sse({"delta": canned, "source": "canned"})
+            yield _sse({}, event="done")
+            return
+
+        key = _canonical_key(norm, req.conversation)
+        cached = await CACHE.get(key) if key is not None else None
+        if cached:
+            CHAT_REPLIES.labels("cache").inc()
+            yield _sse({"delta": cached, "source": "cache"})
+            yield _sse({}, event="done")
+            return
+
+        parts: List[str] = []
+        try:
+            async for delta in PROVIDER.chat_stream(_build_messages(req, user_text), temperature=0.2, max_tokens=512):
+                parts.append(delta)
+                yield _sse({"delta": delta, "source": "llm"})
+        except Exception as e:  # noqa: BLE001 - headers are already sent; report in-band
+            CHAT_REPLIES.labels("error").inc()
+            yield _sse({"detail": f"Provider error: {e}"}, event="error")
+            return
+
+        # Cache the aggregated reply so later /chat and /chat/stream calls hit it
+        reply = postprocess("".join(parts))
+        if reply and key is not None:
+            await CACHE.set(key, reply)
+        CHAT_REPLIES.labels("llm").inc()
+        yield _sse({}, event="done")
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=True)
+    # Development: one auto-reloading process. Setting WEB_CONCURRENCY > 1 runs
+    # that many worker processes instead (reload cannot be combined with it).
+    # uvicorn[standard] brings uvloop and httptools, which "auto" picks up.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run(
+        "app:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        reload=workers == 1,
+        loop="auto",
+        http="auto",
+    )
@@ -6,98 +6,344 @@ canned intents, and post-processing the model output.
 """
 from __future__ import annotations
 
+import contextlib
 from functools import lru_cache
-from typing import Dict, Optional
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+import hashlib
+import json
+import os
 import re
+import tempfile
 import yaml
 
 
+# libyaml-backed loader when available; the pure-Python one is much slower
+_YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def _json_cache_path(path: str, digest: str) -> str:
+    root, _ = os.path.splitext(path)
+    return f"{root}.{digest}.json"
+
+
+def _remove_stale_json_caches(path: str, keep: str) -> None:
+    root, _ = os.path.splitext(os.path.abspath(path))
+    stale = re.compile(re.escape(os.path.basename(root)) + r"\.[0-9a-f]{40}\.json")
+    directory = os.path.dirname(root)
+    for name in os.listdir(directory):
+        full = os.path.join(directory, name)
+        if stale.fullmatch(name) and full != os.path.abspath(keep):
+            with contextlib.suppress(OSError):
+                os.unlink(full)
+
+
 @lru_cache(maxsize=1)
 def load_restaurant(path: str = "restaurant.yml") -> Dict:
-    with open(path, "r", encoding="utf-8") as f:
-        data = yaml.safe_load(f) or {}
+    """Load the restaurant profile.
+
+    The parsed YAML is cached on disk as JSON next to the source file, keyed by
+    the YAML content hash, so later startups skip the YAML parser entirely.
+    Profiles that JSON cannot represent exactly (non-string keys, dates, ...)
+    are never cached, so every startup sees the same dict.
+    """
+    with open(path, "rb") as f:
+        raw = f.read()
+    cache_path = _json_cache_path(path, hashlib.sha1(raw).hexdigest())
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    data = yaml.load(raw.decode("utf-8"), Loader=_YamlLoader) or {}
+    try:
+        encoded = json.dumps(data, ensure_ascii=False)
+        if json.loads(encoded) != data:
+            return data
+    except (TypeError, ValueError):
+        return data
+
+    # Write atomically; a read-only deploy just skips the cache
+    tmp: Optional[str] = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(encoded)
+        os.chmod(tmp, 0o644)  # mkstemp creates 0600; other deploy users must read it
+        os.replace(tmp, cache_path)
+    except OSError:
+        if tmp is not None:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp)
+        return data
+    # Drop caches left behind by earlier versions of the YAML
+    with contextlib.suppress(OSError):
+        _remove_stale_json_caches(path, cache_path)
     return data
 
 
-def canned_reply(user_text: str, data: Dict) -> Optional[str]:
-    """Return a polished canned reply for common intents using strict matching.
-    Uses word-boundary regex to avoid false positives (e.g., 'seat' vs 'eat').
-    """
-    t = (user_text or "").strip().lower()
-
-    # Patterns (word-boundary to prevent substring accidents)
-    hours_pat = re.compile(r"\b(hours?|open|closing?|time|today)\b")
-    menu_pat = re.compile(r"\b(menu|dishes?|food|foods|specials?)\b")
-    address_pat = re.compile(r"\b(address|where|location|directions?|map)\b")
-    phone_pat = re.compile(r"\b(phone|call|number|contact)\b")
-    dietary_pat = re.compile(r"\b(gluten[- ]?free|nut[- ]?free|allergen|vegan|vegetarian)\b")
-    seating_pat = re.compile(r"\b(seat|seating|group|party|booths?|booth|outdoor|patio)\b")
-    reserve_pat = re.compile(r"\b(reserve|reservation|book(ing)?|table)\b")
-
-    if hours_pat.search(t):
-        hours = data.get("hours", {})
-        if hours:
-            lines = ["Our hours:"] + [f"- {day.capitalize()}: {val}" for day, val in hours.items()]
-            return "\n".join(lines)
-        return "We're open daily; please check our website for the latest hours."
-
-    if menu_pat.search(t):
-        url = data.get("menu_url")
-        if url:
-            return f"You can view our menu here: {url}"
-        return "We offer family-style classics and daily specials. Ask us about today's picks!"
-
-    if address_pat.search(t):
-        addr = data.get("address")
-        return f"We're located at: {addr}. Parking is available nearby." if addr else None
-
-    if phone_pat.search(t):
-        phone = data.get("phone")
-        return f"You can reach us at {phone}." if phone else None
-
-    if dietary_pat.search(t):
-        diet = data.get("dietary", {})
-        parts = []
-        if diet.get("gluten_free", True):
-            parts.append("gluten-free")
-        if diet.get("nut_free", True):
-            parts.append("nut-free")
-        if diet.get("vegetarian", True):
-            parts.append("vegetarian")
-        vegan = diet.get("vegan")
-        if vegan:
-            parts.append("vegan options") if vegan is True else parts.append("vegan upon request")
-        joined = ", ".join(parts) if parts else "several dietary"
-        return f"Yes, we offer {joined} options. Please let your server know about any allergies so we can guide you."
-
-    if seating_pat.search(t) or reserve_pat.search(t):
-        seating = data.get("seating", {})
-        outdoor = seating.get("outdoor")
-        booths = seating.get("booths")
-        reservations = data.get("reservations")
-
-        bits = []
-        if reservations is True:
-            bits.append("We accept reservations.")
-        elif reservations is False:
-            bits.append("We don’t take reservations; walk-ins are welcome.")
-        elif isinstance(reservations, str) and reservations:
-            bits.append(reservations)
-
-        if outdoor is True:
-            bits.append("We have outdoor seating.")
-        if booths is True:
-            bits.append("Booths are available.")
-
-        phone = data.get("phone")
-        if not bits:
-            bits.append("Seating availability varies by time and party size.")
-        follow = f" For large groups, please call {phone}." if phone else " For large groups, please call ahead."
-        return " ".join(bits) + follow
+# Optional C-backed keyword scanners, preferred in this order; detection falls
+# back to token-set matching below when neither is installed.
+try:
+    import ahocorasick  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - optional speedup
+    ahocorasick = None
+
+# SIMD multi-pattern matcher; needs the Hyperscan library (x86-64). Its
+# per-scan overhead makes it slower than Aho-Corasick on chat-length input,
+# so it's only used when pyahocorasick is missing.
+try:
+    import hyperscan  # type: ignore[import-not-found]
+except ImportError:  # pragma: no cover - optional speedup
+    hyperscan = None  # type: ignore[assignment]
+
+
+# Canned-intent keywords, in priority order. Matches must sit on word
+# boundaries to prevent substring accidents (e.g., 'seat' vs 'eat').
+# Seating and reservation questions share one reply. The list is the literal
+# expansion of the original regexes, quirks included: `closing?` gives
+# "closin"/"closing" and `dishes?` gives "dishe"/"dishes".
+_INTENT_KEYWORDS = (
+    ("hours", ("hour", "hours", "open", "closin", "closing", "time", "today")),
+    ("menu", ("menu", "dishe", "dishes", "food", "foods", "special", "specials")),
+    ("address", ("address", "where", "location", "direction", "directions", "map")),
+    ("phone", ("phone", "call", "number", "contact")),
+    ("dietary", (
+        "gluten-free", "gluten free", "glutenfree",
+        "nut-free", "nut free", "nutfree",
+        "allergen", "vegan", "vegetarian",
+    )),
+    ("seating", ("seat", "seating", "group", "party", "booth", "booths", "outdoor", "patio")),
+    ("reserve", ("reserve", "reservation", "book", "booking", "table")),
+)
+_INTENT_ORDER = [name for name, _ in _INTENT_KEYWORDS]
+
+# Longer messages are free-form conversation; skip keyword scanning for them
+MAX_CANNED_LEN = 200
 
+# Word-bounded alternation per intent, for Hyperscan
+_INTENT_PATTERNS = [
+    (name, f"\\b(?:{'|'.join(re.escape(kw) for kw in kws)})\\b") for name, kws in _INTENT_KEYWORDS
+]
+
+# Fallback: single-word keywords are looked up in per-intent frozensets after
+# splitting the text into words; only multi-word phrases such as "gluten-free"
+# still need a (small) regex.
+_WORD_SPLIT_RE = re.compile(r"\W+")
+_INTENT_WORDS = [
+    (name, frozenset(kw for kw in kws if not _WORD_SPLIT_RE.search(kw))) for name, kws in _INTENT_KEYWORDS
+]
+_INTENT_PHRASES = [
+    (name, [kw for kw in kws if _WORD_SPLIT_RE.search(kw)]) for name, kws in _INTENT_KEYWORDS
+]
+INTENT_PHRASE_RE = re.compile(
+    "|".join(
+        f"(?P<{name}>\\b(?:{'|'.join(re.escape(kw) for kw in phrases)})\\b)"
+        for name, phrases in _INTENT_PHRASES
+        if phrases
+    ),
+    re.IGNORECASE,
+)
+
+
+def _build_hyperscan_db() -> Any:
+    db = hyperscan.Database()
+    # No SINGLEMATCH: a match rejected by the boundary re-check below must not
+    # hide a later one. SOM_LEFTMOST reports where each match starts.
+    flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_UTF8 | hyperscan.HS_FLAG_SOM_LEFTMOST
+    db.compile(
+        expressions=[pat.encode("utf-8") for _, pat in _INTENT_PATTERNS],
+        ids=list(range(len(_INTENT_PATTERNS))),
+        flags=[flags] * len(_INTENT_PATTERNS),
+    )
+    return db
+
+
+def _char_before(data: bytes, i: int) -> str:
+    j = i - 1
+    while j > 0 and data[j] & 0xC0 == 0x80:  # skip UTF-8 continuation bytes
+        j -= 1
+    return data[j:i].decode("utf-8", "replace")
+
+
+def _char_after(data: bytes, i: int) -> str:
+    lead = data[i]
+    size = 1 if lead < 0x80 else 2 if lead >> 5 == 0b110 else 3 if lead >> 4 == 0b1110 else 4
+    return data[i:i + size].decode("utf-8", "replace")[:1]
+
+
+def _on_hyperscan_match(pattern_id: int, start: int, end: int, flags: int, context: Tuple[bytes, Set[str]]) -> None:
+    data, found = context
+    name = _INTENT_PATTERNS[pattern_id][0]
+    if name in found:
+        return None
+    # Hyperscan's \b is ASCII-only (and unsupported in UCP mode), so re-check
+    # the neighbours as Unicode word characters like the other backends do
+    if start > 0 and _is_word_char(_char_before(data, start)):
+        return None
+    if end < len(data) and _is_word_char(_char_after(data, end)):
+        return None
+    found.add(name)
     return None
 
 
+def _build_automaton() -> Any:
+    automaton = ahocorasick.Automaton()
+    for name, kws in _INTENT_KEYWORDS:
+        for kw in kws:
+            automaton.add_word(kw, (name, len(kw)))
+    automaton.make_automaton()
+    return automaton
+
+
+INTENT_AUTOMATON = _build_automaton() if ahocorasick is not None else None
+INTENT_DB = _build_hyperscan_db() if hyperscan is not None and INTENT_AUTOMATON is None else None
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+def _hours_reply(data: Dict) -> Optional[str]:
+    hours = data.get("hours", {})
+    if hours:
+        lines = ["Our hours:"] + [f"- {day.capitalize()}: {val}" for day, val in hours.items()]
+        return "\n".join(lines)
+    return "We're open daily; please check our website for the latest hours."
+
+
+def _menu_reply(data: Dict) -> Optional[str]:
+    url = data.get("menu_url")
+    if url:
+        return f"You can view our menu here: {url}"
+    return "We offer family-style classics and daily specials. Ask us about today's picks!"
+
+
+def _address_reply(data: Dict) -> Optional[str]:
+    addr = data.get("address")
+    return f"We're located at: {addr}. Parking is available nearby." if addr else None
+
+
+def _phone_reply(data: Dict) -> Optional[str]:
+    phone = data.get("phone")
+    return f"You can reach us at {phone}." if phone else None
+
+
+def _dietary_reply(data: Dict) -> Optional[str]:
+    diet = data.get("dietary", {})
+    parts = []
+    if diet.get("gluten_free", True):
+        parts.append("gluten-free")
+    if diet.get("nut_free", True):
+        parts.append("nut-free")
+    if diet.get("vegetarian", True):
+        parts.append("vegetarian")
+    vegan = diet.get("vegan")
+    if vegan:
+        parts.append("vegan options") if vegan is True else parts.append("vegan upon request")
+    joined = ", ".join(parts) if parts else "several dietary"
+    return f"Yes, we offer {joined} options. Please let your server know about any allergies so we can guide you."
+
+
+def _seating_reply(data: Dict) -> Optional[str]:
+    seating = data.get("seating", {})
+    outdoor = seating.get("outdoor")
+    booths = seating.get("booths")
+    reservations = data.get("reservations")
+
+    bits = []
+    if reservations is True:
+        bits.append("We accept reservations.")
+    elif reservations is False:
+        bits.append("We don’t take reservations; walk-ins are welcome.")
+    elif isinstance(reservations, str) and reservations:
+        bits.append(reservations)
+
+    if outdoor is True:
+        bits.append("We have outdoor seating.")
+    if booths is True:
+        bits.append("Booths are available.")
+
+    phone = data.get("phone")
+    if not bits:
+        bits.append("Seating availability varies by time and party size.")
+    follow = f" For large groups, please call {phone}." if phone else " For large groups, please call ahead."
+    return " ".join(bits) + follow
+
+
+_DISPATCH: Dict[str, Callable[[Dict], Optional[str]]] = {
+    "hours": _hours_reply,
+    "menu": _menu_reply,
+    "address": _address_reply,
+    "phone": _phone_reply,
+    "dietary": _dietary_reply,
+    "seating": _seating_reply,
+    "reserve": _seating_reply,
+}
+
+
+def _scan_intents(t: str) -> Set[str]:
+    """Collect every intent whose keywords appear in `t`, which must be lowercase."""
+    found: Set[str] = set()
+    if INTENT_AUTOMATON is None:
+        if INTENT_DB is not None:
+            data = t.encode("utf-8", "replace")
+            INTENT_DB.scan(data, match_event_handler=_on_hyperscan_match, context=(data, found))
+            return found
+        words = set(_WORD_SPLIT_RE.split(t))
+        found = {name for name, kws in _INTENT_WORDS if not kws.isdisjoint(words)}
+        found.update(m.lastgroup for m in INTENT_PHRASE_RE.finditer(t) if m.lastgroup)
+        return found
+    n = len(t)
+    for end, (name, length) in INTENT_AUTOMATON.iter(t):
+        start = end - length + 1
+        if start > 0 and _is_word_char(t[start - 1]):
+            continue
+        if end + 1 < n and _is_word_char(t[end + 1]):
+            continue
+        found.add(name)
+    return found
+
+
+def detect_intent(user_text: str, norm: Optional[str] = None) -> Optional[str]:
+    """Return the highest-priority canned intent mentioned in the text, if any.
+    Pass `norm` (the lowercased text) when the caller already has it.
+    """
+    found = _scan_intents(norm if norm is not None else (user_text or "").lower())
+    if not found:
+        return None
+    for name in _INTENT_ORDER:
+        if name in found:
+            return name
+    return None
+
+
+def build_canned_replies(data: Dict) -> Dict[str, str]:
+    """Render every canned reply for a restaurant profile, keyed by intent.
+    Intents with nothing to say (e.g., no phone on file) are left out.
+    """
+    replies: Dict[str, str] = {}
+    for intent, render in _DISPATCH.items():
+        reply = render(data)
+        if reply:
+            replies[intent] = reply
+    return replies
+
+
+def canned_reply(user_text: str, replies: Dict[str, str], norm: Optional[str] = None) -> Optional[str]:
+    """Return a polished canned reply for common intents using strict matching.
+    Keywords must match on word boundaries to avoid false positives (e.g., 'seat' vs 'eat').
+    `replies` is the precomputed output of build_canned_replies; `norm` is the
+    already-lowercased text, if the caller has it.
+    """
+    if len(user_text) > MAX_CANNED_LEN:
+        return None
+    intent = detect_intent(user_text, norm)
+    if intent is None:
+        return None
+    return replies.get(intent)
+
+
 def build_system_prompt(data: Dict) -> str:
     name = data.get("name", "the restaurant")
     address = data.get("address", "")
@@ -8,9 +8,11 @@ OpenAI, Azure OpenAI (with compat), or a self-hosted compatible endpoint.
 from __future__ import annotations
 
 import os
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Dict, Any, Optional
 
 import httpx
+import orjson
 
 PROVIDER_BASE_URL = os.getenv("PROVIDER_BASE_URL", "https://api.openai.com/v1")
 PROVIDER_API_KEY = os.getenv("PROVIDER_API_KEY", "")
@@ -18,51 +20,119 @@ PROVIDER_MODEL = os.getenv("PROVIDER_MODEL", "gpt-4o-mini")
 PROVIDER_KIND = os.getenv("PROVIDER_KIND", "openai").strip().lower()  # openai | azure | other
 AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION", "")
 
+# Shared connection pool settings; one client is reused across requests so
+# TCP/TLS connections to the provider stay warm.
+HTTP_TIMEOUT = 20.0
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+
+
+@dataclass(frozen=True, repr=False)  # no repr: headers carry the API key
+class ProviderCfg:
+    """Resolved endpoint, headers and model; built once, read on every request."""
+
+    __slots__ = ("url", "headers", "model", "api_key")
+
+    url: str
+    headers: Dict[str, str]
+    model: str
+    api_key: str
+
+
+def build_provider_cfg(base_url: Optional[str] = None, api_key: Optional[str] = None, model: Optional[str] = None) -> ProviderCfg:
+    base_url = base_url or PROVIDER_BASE_URL
+    api_key = (api_key or PROVIDER_API_KEY).strip()
+    model = model or PROVIDER_MODEL
+
+    # Configure endpoint and headers according to provider kind
+    if (base_url.endswith("/v1") or base_url.endswith("/v1/") or PROVIDER_KIND in {"openai", "other"}) and PROVIDER_KIND != "azure":
+        # Standard OpenAI-compatible (OpenAI, Groq, etc.)
+        url = f"{base_url.rstrip('/')}/chat/completions"
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+    else:
+        # Azure OpenAI compatibility
+        # Expect base_url like: https://{resource}.openai.azure.com/openai
+        # model is the deployment name; api-version is required
+        if not AZURE_OPENAI_API_VERSION:
+            raise ValueError("AZURE_OPENAI_API_VERSION is required for PROVIDER_KIND=azure")
+        base = base_url.rstrip('/')
+        if not base.endswith('/openai'):
+            base = base + '/openai'
+        url = f"{base}/deployments/{model}/chat/completions?api-version={AZURE_OPENAI_API_VERSION}"
+        headers = {
+            "api-key": api_key,
+            "Content-Type": "application/json",
+        }
+    return ProviderCfg(url=url, headers=headers, model=model, api_key=api_key)
+
 
 class ChatProvider:
     def __init__(self, base_url: Optional[str] = None, api_key: Optional[str] = None, model: Optional[str] = None):
-        self.base_url = base_url or PROVIDER_BASE_URL
-        self.api_key = api_key or PROVIDER_API_KEY
-        self.model = model or PROVIDER_MODEL
-
-        # Configure endpoint and headers according to provider kind
-        if (self.base_url.endswith("/v1") or self.base_url.endswith("/v1/") or PROVIDER_KIND in {"openai", "other"}) and PROVIDER_KIND != "azure":
-            # Standard OpenAI-compatible (OpenAI, Groq, etc.)
-            self._chat_url = f"{self.base_url.rstrip('/')}/chat/completions"
-            self._headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json",
-            }
-        else:
-            # Azure OpenAI compatibility
-            # Expect base_url like: https://{resource}.openai.azure.com/openai
-            # model is the deployment name; api-version is required
-            if not AZURE_OPENAI_API_VERSION:
-                raise ValueError("AZURE_OPENAI_API_VERSION is required for PROVIDER_KIND=azure")
-            base = self.base_url.rstrip('/')
-            if not base.endswith('/openai'):
-                base = base + '/openai'
-            self._chat_url = f"{base}/deployments/{self.model}/chat/completions?api-version={AZURE_OPENAI_API_VERSION}"
-            self._headers = {
-                "api-key": self.api_key,
-                "Content-Type": "application/json",
-            }
+        self.cfg = build_provider_cfg(base_url, api_key, model)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def open(self) -> httpx.AsyncClient:
+        """Create the pooled HTTP/2 client. Call once per process at startup."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(http2=True, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the pooled client and drop its connections."""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def chat(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int = 512) -> str:
         """Send a chat completion request and return the assistant message text.
         If the provider fails, raise an exception so the caller can handle fallback.
         """
-        if not (self.api_key and self.api_key.strip()):
+        cfg = self.cfg
+        if not cfg.api_key:
+            raise ValueError("Missing PROVIDER_API_KEY. Set it in .env and restart the server.")
+        payload: Dict[str, Any] = {
+            "model": cfg.model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        client = self._client or await self.open()
+        resp = await client.post(cfg.url, headers=cfg.headers, content=orjson.dumps(payload))
+        resp.raise_for_status()
+        data = orjson.loads(resp.content)
+        # OpenAI-like shape
+        return data["choices"][0]["message"]["content"].strip()
+
+    async def chat_stream(self, messages: List[Dict[str, str]], temperature: float = 0.2, max_tokens: int = 512) -> AsyncIterator[str]:
+        """Stream a chat completion, yielding assistant text deltas as they arrive.
+        Parses the provider's server-sent events; raises on provider failure.
+        """
+        cfg = self.cfg
+        if not cfg.api_key:
             raise ValueError("Missing PROVIDER_API_KEY. Set it in .env and restart the server.")
         payload: Dict[str, Any] = {
-            "model": self.model,
+            "model": cfg.model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
+            "stream": True,
         }
-        async with httpx.AsyncClient(timeout=20.0) as client:
-            resp = await client.post(self._chat_url, headers=self._headers, json=payload)
+        client = self._client or await self.open()
+        async with client.stream("POST", cfg.url, headers=cfg.headers, content=orjson.dumps(payload)) as resp:
             resp.raise_for_status()
-            data = resp.json()
-            # OpenAI-like shape
-            return data["choices"][0]["message"]["content"].strip()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                chunk = orjson.loads(data)
+                # Azure may send chunks with no choices (e.g., content filter results)
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta